@@ -2,59 +2,122 @@
 # app/main.py
 # ------------------------------------------------------------
 # FastAPI + SQLAlchemy (MySQL) com versionamento e event log
-from datetime import datetime, date
-from typing import Optional, List, Dict, Any
+from datetime import datetime, date, timezone
+from typing import Optional, List, Dict, Any, AsyncIterator
 
 from fastapi import FastAPI, HTTPException, Path
-from fastapi import Body, Query
-from pydantic import BaseModel, Field
+from fastapi import Body, Depends, Query
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.decorator import cache
+from redis import asyncio as aioredis
+from pydantic import BaseModel, ConfigDict, Field
 from sqlalchemy import (
-    create_engine, Column, Integer, BigInteger, String, Date, DateTime,
-    JSON, ForeignKey, func, Boolean
+    Column, Integer, BigInteger, String, Date, DateTime,
+    ForeignKey, func, Boolean, select, insert, update, text, bindparam, column, or_, case
 )
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base, relationship
+import logging
 import os
 
+import orjson
+
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 
-DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# asyncpg prepara cada statement e o mantém em cache por conexão (parse/plano reaproveitados)
+DATABASE_URL = (
+    f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    "?prepared_statement_cache_size=500"
+)
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, future=True)
-SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+# colunas JSONB (de)serializadas com orjson: date/datetime vão direto nos dicts, sem .isoformat()
+engine = create_async_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=20,
+    max_overflow=40,
+    json_serializer=lambda obj: orjson.dumps(obj).decode(),
+    json_deserializer=orjson.loads,
+)
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+async def get_session() -> AsyncIterator[AsyncSession]:
+    async with SessionLocal() as sess:
+        yield sess
+
 # ------------------ Models ------------------
 class Pessoa(Base):
     __tablename__ = "pessoa"
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     nome = Column(String(120), nullable=False)
-    cpf = Column(String(14), nullable=False, unique=True)
+    cpf = Column(String(14), nullable=False)
     data_nascimento = Column(Date, nullable=False)
     version = Column(Integer, nullable=False, default=1)
     deleted = Column(Boolean, nullable=False, default=False)
-    updated_at = Column(DateTime, nullable=False, default=func.now(), onupdate=func.now())
-    created_at = Column(DateTime, nullable=False, default=func.now())
+    # timestamps sempre pelo relógio do banco (server_default / now() no UPDATE)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
 
     events = relationship("PessoaEvent", back_populates="pessoa", order_by="PessoaEvent.new_version")
 
+# pessoa_event é particionada por hash de pessoa_id: o replay de uma pessoa só toca
+# o índice de uma partição (as partições são criadas em STARTUP_DDL)
+EVENT_PARTITIONS = 16
+
 class PessoaEvent(Base):
     __tablename__ = "pessoa_event"
+    __table_args__ = {"postgresql_partition_by": "HASH (pessoa_id)"}
     id = Column(BigInteger, primary_key=True, autoincrement=True)
-    pessoa_id = Column(BigInteger, ForeignKey("pessoa.id"), nullable=False)
+    # a PK de tabela particionada precisa incluir a chave de partição
+    pessoa_id = Column(BigInteger, ForeignKey("pessoa.id"), primary_key=True)
     base_version = Column(Integer, nullable=False)
     new_version = Column(Integer, nullable=False)
     # 'changes' é o delta aplicado nessa transição
-    changes = Column(JSON, nullable=False)
-    # 'state_after' é o snapshot completo após aplicar o evento
-    state_after = Column(JSON, nullable=False)
-    created_at = Column(DateTime, nullable=False, default=func.now())
+    changes = Column(JSONB, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
 
     pessoa = relationship("Pessoa", back_populates="events")
 
+# colunas expostas em PessoaOut, usadas nas leituras via Core (sem hidratar o ORM)
+_PESSOA_COLS = (
+    Pessoa.id, Pessoa.nome, Pessoa.cpf, Pessoa.data_nascimento, Pessoa.version, Pessoa.updated_at,
+)
+
+# statements das rotas quentes montados uma vez, com forma fixa e só parâmetros variando
+# (mesmo SQL a cada request => prepared statement reaproveitado)
+_GET_BY_ID = select(*_PESSOA_COLS).where(Pessoa.id == bindparam("id"), Pessoa.deleted == False)  # noqa: E712
+_GET_VERSION = select(Pessoa.version).where(Pessoa.id == bindparam("id"), Pessoa.deleted == False)  # noqa: E712
+# linha de pessoa antes da escrita (UPDATE ... FROM), para o evento registrar só o que mudou
+_PESSOA_ANTES = Pessoa.__table__.alias("antes")
+
+# listagem paginada por keyset em id (seek pelo índice da PK, sem OFFSET)
+_LIST_ALL = (
+    select(*_PESSOA_COLS)
+    .where(Pessoa.id > bindparam("after"), Pessoa.updated_at >= bindparam("modified_since"))
+    .order_by(Pessoa.id.asc())
+    .limit(bindparam("limit"))
+)
+# pessoas ativas: seek pelo índice parcial pessoa_live_id
+_LIST_LIVE = (
+    select(*_PESSOA_COLS)
+    .where(
+        Pessoa.id > bindparam("after"),
+        Pessoa.updated_at >= bindparam("modified_since"),
+        Pessoa.deleted == False,  # noqa: E712
+    )
+    .order_by(Pessoa.id.asc())
+    .limit(bindparam("limit"))
+)
+
 # ------------------ Schemas ------------------
 class PessoaOut(BaseModel):
     id: int
@@ -64,278 +127,420 @@ class PessoaOut(BaseModel):
     version: int
     updated_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class PessoaPage(BaseModel):
+    items: List[PessoaOut]
+    # id a passar em 'after' para a próxima página (None na última)
+    next: Optional[int] = None
 
 class PessoaCreate(BaseModel):
     nome: str = Field(..., max_length=120)
     cpf: str = Field(..., max_length=14)
     data_nascimento: date
 
+# 'version' é INTEGER no banco: valores fora da faixa viram 422 na validação, não erro do asyncpg
+VERSION_MAX = 2**31 - 1
+# ids são BIGINT: o asyncpg envia o parâmetro tipado e recusa valores acima de int64 (=> 500)
+ID_MAX = 2**63 - 1
+
 class PessoaPatch(BaseModel):
-    version: int = Field(..., description="Versão conhecida pelo cliente")
+    version: int = Field(..., ge=1, le=VERSION_MAX, description="Versão conhecida pelo cliente")
     nome: Optional[str] = Field(None, max_length=120)
     cpf: Optional[str] = Field(None, max_length=14)
     data_nascimento: Optional[date] = None
 
 # ------------------ Helpers ------------------
 
-def pessoa_to_dict(p: Pessoa) -> Dict[str, Any]:
-    return {
-        "id": p.id,
-        "nome": p.nome,
-        "cpf": p.cpf,
-        "data_nascimento": p.data_nascimento.isoformat(),
-        "version": p.version,
-        "deleted": p.deleted,
-        "updated_at": p.updated_at.isoformat() if p.updated_at else None,
-    }
-
-# aplica um delta (changes) em um estado base (dict) retornando novo estado
-# regra: LWW por campo (valor do delta vence para os campos presentes)
-
-def apply_changes(base_state: Dict[str, Any], changes: Dict[str, Any]) -> Dict[str, Any]:
-    new_state = dict(base_state)
-    for k, v in changes.items():
-        new_state[k] = v
-    return new_state
+# PATCH com cliente atrasado resolvido num único statement no Postgres:
+# o delta do cliente perde os campos tocados por eventos em (client_version .. current_version]
+# (LWW por campo) e, dos que sobram, só os que diferem da linha atual são aplicados.
+# Se nenhum campo mudar, nada é escrito (nenhuma linha devolvida).
+# Retorna a linha atualizada e o delta efetivamente aplicado (coluna 'changes').
+REPLAY_PATCH_SQL = text("""
+    UPDATE pessoa SET
+        nome = COALESCE(delta.changes->>'nome', pessoa.nome),
+        cpf = COALESCE(delta.changes->>'cpf', pessoa.cpf),
+        data_nascimento = COALESCE(CAST(delta.changes->>'data_nascimento' AS date), pessoa.data_nascimento),
+        version = pessoa.version + 1,
+        updated_at = now()
+    FROM (
+        SELECT COALESCE(jsonb_object_agg(c.key, c.value), '{}'::jsonb) AS changes
+        FROM jsonb_each(CAST(:changes AS jsonb)) AS c, pessoa AS atual
+        WHERE atual.id = :id
+          AND c.value IS DISTINCT FROM to_jsonb(atual) -> c.key
+          AND c.key NOT IN (
+            SELECT DISTINCT jsonb_object_keys(changes)
+            FROM pessoa_event
+            WHERE pessoa_id = :id AND new_version > :client_version AND new_version <= :current_version
+        )
+    ) AS delta
+    WHERE pessoa.id = :id AND pessoa.version = :current_version AND pessoa.deleted = false
+      AND delta.changes <> '{}'::jsonb
+    RETURNING pessoa.id, pessoa.nome, pessoa.cpf, pessoa.data_nascimento, pessoa.version,
+              pessoa.updated_at, delta.changes AS changes
+""").bindparams(bindparam("changes", type_=JSONB)).columns(
+    *(column(c.key, c.type) for c in _PESSOA_COLS), column("changes", JSONB),
+)
 
-# reconstrói o snapshot de uma pessoa em uma versão específica usando o event log
+# executa uma escrita traduzindo violação de unicidade (CPF entre pessoas ativas) em 409
 
-def snapshot_at_version(sess, pessoa_id: int, target_version: int) -> Dict[str, Any]:
-    ev = (
-        sess.query(PessoaEvent)
-        .filter(PessoaEvent.pessoa_id == pessoa_id, PessoaEvent.new_version == target_version)
-        .one_or_none()
-    )
-    if ev is None:
-        raise HTTPException(status_code=409, detail="Versão solicitada inexistente para reconstrução")
-    return dict(ev.state_after)
-
-# reaplica eventos de (from_version+1 .. to_version) sobre um estado inicial
-
-def replay_forward(sess, pessoa_id: int, from_version: int, to_version: int, state: Dict[str, Any]) -> Dict[str, Any]:
-    if to_version <= from_version:
-        return state
-    evs = (
-        sess.query(PessoaEvent)
-        .filter(
-            PessoaEvent.pessoa_id == pessoa_id,
-            PessoaEvent.new_version > from_version,
-            PessoaEvent.new_version <= to_version,
+async def execute_or_conflict(sess: AsyncSession, stmt, detail: str, params=None):
+    try:
+        return await sess.execute(stmt, params)
+    except IntegrityError as e:
+        # só o índice de CPF vira 409; FK, partição ausente etc. são bugs e sobem como estão
+        # (o erro do asyncpg, com o nome da constraint, é a causa do erro do adaptador DBAPI)
+        if getattr(e.orig.__cause__, "constraint_name", None) != "ux_pessoa_cpf_live":
+            raise
+        raise HTTPException(status_code=409, detail=detail)
+
+# transforma uma escrita em pessoa (INSERT/UPDATE ... RETURNING) num único statement que também
+# grava o evento (CTE de escrita: um round-trip só).
+# 'changes' é o delta do evento; se None, usa a coluna 'changes' devolvida pela própria escrita.
+# Retorna o SELECT das colunas de _PESSOA_COLS da linha escrita.
+
+def with_event(write, changes: Optional[Dict[str, Any]] = None):
+    w = write.cte("escrita")
+    ev_changes = w.c.changes if changes is None else bindparam("event_changes", changes, type_=JSONB)
+    ev = insert(PessoaEvent).from_select(
+        ["pessoa_id", "base_version", "new_version", "changes"],
+        select(w.c.id, w.c.version - 1, w.c.version, ev_changes),
+    ).cte("ev")
+    return select(*(w.c[c.key] for c in _PESSOA_COLS)).add_cte(ev)
+
+# ------------------ Cache ------------------
+# GET /pessoas/{id} fica em 'pessoa:<id>' (invalidação pontual);
+# a listagem fica no namespace 'pessoas' e expira só pelo TTL curto (sem varrer chaves a cada escrita)
+
+CACHE_PREFIX = "pessoas"
+
+def pessoa_key_builder(func, namespace: str = "", *, request=None, response=None, args=(), kwargs=None) -> str:
+    return f"{namespace}:{kwargs['pessoa_id']}"
+
+# chave pela query string (a sessão injetada não entra na chave)
+def pessoas_key_builder(func, namespace: str = "", *, request=None, response=None, args=(), kwargs=None) -> str:
+    return f"{namespace}:{sorted(request.query_params.multi_items())}"
+
+logger = logging.getLogger(__name__)
+
+# roda depois do commit: falha no Redis não pode virar 500 de uma escrita já gravada
+# (a entrada antiga expira pelo TTL)
+async def invalidate_cache(pessoa_id: int):
+    try:
+        await FastAPICache.get_backend().clear(key=f"{CACHE_PREFIX}:pessoa:{pessoa_id}")
+    except Exception:
+        logger.exception("falha ao invalidar cache da pessoa %s", pessoa_id)
+
+# ------------------ DDL ------------------
+STARTUP_DDL = [
+    # defaults de timestamp no próprio banco (tabelas criadas antes do server_default);
+    # só as colunas ainda sem default em pg_attrdef (o ALTER trava a tabela inteira)
+    """
+    DO $$
+    DECLARE
+        alvo record;
+    BEGIN
+        FOR alvo IN
+            SELECT * FROM (VALUES ('pessoa', 'updated_at'), ('pessoa', 'created_at'), ('pessoa_event', 'created_at'))
+            AS t(tabela, coluna)
+        LOOP
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_attrdef d
+                JOIN pg_attribute a ON a.attrelid = d.adrelid AND a.attnum = d.adnum
+                WHERE d.adrelid = alvo.tabela::regclass AND a.attname = alvo.coluna
+            ) THEN
+                EXECUTE format('ALTER TABLE %I ALTER COLUMN %I SET DEFAULT now()', alvo.tabela, alvo.coluna);
+            END IF;
+        END LOOP;
+    END $$
+    """,
+    # unicidade de CPF apenas entre pessoas ativas (substitui o UNIQUE da coluna);
+    # o DROP CONSTRAINT trava 'pessoa', então só roda enquanto a constraint existir
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_constraint
+                   WHERE conrelid = 'pessoa'::regclass AND conname = 'pessoa_cpf_key') THEN
+            ALTER TABLE pessoa DROP CONSTRAINT pessoa_cpf_key;
+        END IF;
+    END $$
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_pessoa_cpf_live ON pessoa (cpf) WHERE deleted = false",
+    # partições de pessoa_event (só se a tabela já foi criada particionada;
+    # uma pessoa_event antiga, não particionada, é recriada pela migração 002)
+    f"""
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'pessoa_event'::regclass) THEN
+            FOR i IN 0..{EVENT_PARTITIONS - 1} LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS pessoa_event_p%s PARTITION OF pessoa_event '
+                    'FOR VALUES WITH (MODULUS {EVENT_PARTITIONS}, REMAINDER %s)', i, i
+                );
+            END LOOP;
+        END IF;
+    END $$
+    """,
+    # 'changes' em jsonb (bancos antigos têm json); o replay usa jsonb_object_keys/jsonb_each.
+    # só altera se ainda for json: o ALTER trava pessoa_event e todas as partições
+    """
+    DO $$
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'pessoa_event'
+              AND column_name = 'changes') = 'json' THEN
+            ALTER TABLE pessoa_event ALTER COLUMN changes TYPE jsonb USING changes::jsonb;
+        END IF;
+    END $$
+    """,
+    # eventos guardam só o delta: enquanto a migração 001 não roda, o snapshot legado
+    # só deixa de ser obrigatório (o INSERT do evento não o preenche)
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_attribute
+                   WHERE attrelid = 'pessoa_event'::regclass AND attname = 'state_after'
+                     AND attnotnull AND NOT attisdropped) THEN
+            ALTER TABLE pessoa_event ALTER COLUMN state_after DROP NOT NULL;
+        END IF;
+    END $$
+    """,
+    "DROP INDEX IF EXISTS pessoa_event_pid_ver_cov",
+    # replay por (pessoa, versão)
+    "CREATE INDEX IF NOT EXISTS pessoa_event_pid_ver ON pessoa_event (pessoa_id, new_version DESC)",
+    # listagem de pessoas ativas direto de 'pessoa' por índice parcial
+    "CREATE INDEX IF NOT EXISTS pessoa_live_id ON pessoa (id) WHERE deleted = false",
+]
+
+# migrações destrutivas não rodam no startup: ficam em app/migrations/ e são aplicadas
+# pelo operador (ver readme). O startup só avisa quando alguma ainda está pendente.
+PENDING_MIGRATIONS = {
+    "001_drop_event_snapshots.sql": """
+        SELECT to_regclass('pessoa_checkpoint') IS NOT NULL OR EXISTS (
+            SELECT 1 FROM pg_attribute
+            WHERE attrelid = 'pessoa_event'::regclass AND attname = 'state_after' AND NOT attisdropped
         )
-        .order_by(PessoaEvent.new_version.asc())
-        .all()
-    )
-    s = dict(state)
-    for ev in evs:
-        s = apply_changes(s, ev.changes)
-    return s
-
-# cria e persiste um evento com snapshot pós-aplicação
-
-def persist_event(sess, pessoa: Pessoa, base_version: int, changes: Dict[str, Any]):
-    # construir snapshot após aplicar changes ao estado atual do ORM (já atualizado)
-    state_after = {
-        "id": pessoa.id,
-        "nome": pessoa.nome,
-        "cpf": pessoa.cpf,
-        "data_nascimento": pessoa.data_nascimento.isoformat(),
-        "version": pessoa.version,
-        "deleted": pessoa.deleted,
-        "updated_at": pessoa.updated_at.isoformat() if pessoa.updated_at else None,
-    }
-    ev = PessoaEvent(
-        pessoa_id=pessoa.id,
-        base_version=base_version,
-        new_version=pessoa.version,
-        changes=changes,
-        state_after=state_after,
-    )
-    sess.add(ev)
+    """,
+    "002_partition_pessoa_event.sql": """
+        SELECT NOT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'pessoa_event'::regclass)
+    """,
+}
 
 # ------------------ App ------------------
 app = FastAPI(title="Pessoas API", version="1.0.0")
 
 @app.on_event("startup")
-def on_startup():
-    Base.metadata.create_all(engine)
+async def on_startup():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        for ddl in STARTUP_DDL:
+            await conn.execute(text(ddl))
+        for migration, pendente in PENDING_MIGRATIONS.items():
+            if (await conn.execute(text(pendente))).scalar():
+                logger.warning("migração pendente: app/migrations/%s", migration)
+    FastAPICache.init(RedisBackend(aioredis.from_url(REDIS_URL)), prefix=CACHE_PREFIX)
 
 # 1) Listar pessoas (com filtros opcionais)
-@app.get("/pessoas", response_model=List[PessoaOut])
-def list_pessoas(
+@app.get("/pessoas", response_model=PessoaPage)
+@cache(expire=2, namespace="pessoas", key_builder=pessoas_key_builder)
+async def list_pessoas(
     modified_since: Optional[datetime] = Query(None),
     include_deleted: bool = Query(False),
+    after: Optional[int] = Query(None, ge=0, le=ID_MAX, description="Último id da página anterior"),
+    limit: int = Query(100, ge=1, le=1000),
+    sess: AsyncSession = Depends(get_session),
 ):
-    sess = SessionLocal()
-    try:
-        q = sess.query(Pessoa)
-        if not include_deleted:
-            q = q.filter(Pessoa.deleted == False)  # noqa: E712
-        if modified_since:
-            q = q.filter(Pessoa.updated_at >= modified_since)
-        rows = q.order_by(Pessoa.id.asc()).all()
-        return rows
-    finally:
-        sess.close()
+    # updated_at é 'timestamp without time zone' (UTC); asyncpg não aceita datetime com tz
+    if modified_since and modified_since.tzinfo is not None:
+        modified_since = modified_since.astimezone(timezone.utc).replace(tzinfo=None)
+    # sem filtro => valores neutros (ids começam em 1), para manter uma única forma de SQL
+    params = {"after": after or 0, "modified_since": modified_since or datetime.min, "limit": limit}
+    rows = (await sess.execute(_LIST_ALL if include_deleted else _LIST_LIVE, params)).all()
+    items = [r._asdict() for r in rows]
+    return {"items": items, "next": items[-1]["id"] if len(items) == limit else None}
 
 # 2) Obter pessoa
 @app.get("/pessoas/{pessoa_id}", response_model=PessoaOut)
-def get_pessoa(pessoa_id: int = Path(...)):
-    sess = SessionLocal()
-    try:
-        p = sess.query(Pessoa).filter(Pessoa.id == pessoa_id, Pessoa.deleted == False).one_or_none()  # noqa: E712
-        if not p:
-            raise HTTPException(status_code=404, detail="Pessoa não encontrada")
-        return p
-    finally:
-        sess.close()
+@cache(expire=60, namespace="pessoa", key_builder=pessoa_key_builder)
+async def get_pessoa(pessoa_id: int = Path(..., ge=1, le=ID_MAX), sess: AsyncSession = Depends(get_session)):
+    row = (await sess.execute(_GET_BY_ID, {"id": pessoa_id})).one_or_none()
+    if not row:
+        raise HTTPException(status_code=404, detail="Pessoa não encontrada")
+    return row._asdict()
 
 # 3) Criar pessoa
 @app.post("/pessoas", response_model=PessoaOut, status_code=201)
-def create_pessoa(payload: PessoaCreate):
-    sess = SessionLocal()
-    try:
-        # valida unicidade de CPF
-        exists = sess.query(Pessoa).filter(Pessoa.cpf == payload.cpf, Pessoa.deleted == False).one_or_none()  # noqa: E712
-        if exists:
-            raise HTTPException(status_code=409, detail="CPF já cadastrado")
-        p = Pessoa(
-            nome=payload.nome,
-            cpf=payload.cpf,
-            data_nascimento=payload.data_nascimento,
-            version=1,
-            deleted=False,
-        )
-        sess.add(p)
-        sess.flush()  # para obter ID
-        # evento de criação: base 0 -> new 1
-        changes = {
-            "nome": p.nome,
-            "cpf": p.cpf,
-            "data_nascimento": p.data_nascimento.isoformat(),
-            "deleted": False,
-        }
-        persist_event(sess, p, base_version=0, changes=changes)
-        sess.commit()
-        sess.refresh(p)
-        return p
-    finally:
-        sess.close()
+async def create_pessoa(payload: PessoaCreate, sess: AsyncSession = Depends(get_session)):
+    # a unicidade de CPF é garantida pelo índice ux_pessoa_cpf_live
+    # evento de criação: base 0 -> new 1
+    changes = {
+        "nome": payload.nome,
+        "cpf": payload.cpf,
+        "data_nascimento": payload.data_nascimento,
+        "deleted": False,
+    }
+    row = (await execute_or_conflict(
+        sess,
+        with_event(
+            insert(Pessoa).values(
+                nome=payload.nome,
+                cpf=payload.cpf,
+                data_nascimento=payload.data_nascimento,
+                version=1,
+                deleted=False,
+            ).returning(*_PESSOA_COLS),
+            changes,
+        ),
+        "CPF já cadastrado",
+    )).one()
+    await sess.commit()
+    await invalidate_cache(row.id)
+    return row._asdict()
 
 # 4) Editar (PATCH) com OCC + replay via log
 @app.patch("/pessoas/{pessoa_id}", response_model=PessoaOut)
-def patch_pessoa(pessoa_id: int, payload: PessoaPatch = Body(...)):
-    sess = SessionLocal()
-    try:
-        p = sess.query(Pessoa).filter(Pessoa.id == pessoa_id, Pessoa.deleted == False).one_or_none()  # noqa: E712
-        if not p:
+async def patch_pessoa(
+    pessoa_id: int = Path(..., ge=1, le=ID_MAX),
+    payload: PessoaPatch = Body(...),
+    sess: AsyncSession = Depends(get_session),
+):
+    client_version = payload.version
+
+    # definir changes enviados pelo cliente
+    provided_changes: Dict[str, Any] = {}
+    if payload.nome is not None:
+        provided_changes["nome"] = payload.nome
+    if payload.cpf is not None:
+        # unicidade revalidada pelo índice na escrita
+        provided_changes["cpf"] = payload.cpf
+    if payload.data_nascimento is not None:
+        provided_changes["data_nascimento"] = payload.data_nascimento
+
+    if not provided_changes:
+        # nada a alterar, retorna atual
+        row = (await sess.execute(_GET_BY_ID, {"id": pessoa_id})).one_or_none()
+        if not row:
             raise HTTPException(status_code=404, detail="Pessoa não encontrada")
-
-        current_version = p.version
-        client_version = payload.version
-        if client_version <= 0:
-            raise HTTPException(status_code=400, detail="Versão inválida")
-
-        # definir changes enviados pelo cliente
-        provided_changes: Dict[str, Any] = {}
-        if payload.nome is not None:
-            provided_changes["nome"] = payload.nome
-        if payload.cpf is not None:
-            # opcional: revalidar unicidade se cpf alterar
-            other = (
-                sess.query(Pessoa)
-                .filter(Pessoa.cpf == payload.cpf, Pessoa.id != pessoa_id, Pessoa.deleted == False)
-                .one_or_none()
-            )
-            if other:
-                raise HTTPException(status_code=409, detail="CPF já utilizado por outra pessoa")
-            provided_changes["cpf"] = payload.cpf
-        if payload.data_nascimento is not None:
-            provided_changes["data_nascimento"] = payload.data_nascimento.isoformat()
-
-        if not provided_changes:
-            # nada a alterar, retorna atual
-            return p
-
-        if client_version == current_version:
-            # caminho simples: aplica direto
-            base_version = current_version
-            # aplicar no ORM
-            if "nome" in provided_changes:
-                p.nome = provided_changes["nome"]
-            if "cpf" in provided_changes:
-                p.cpf = provided_changes["cpf"]
-            if "data_nascimento" in provided_changes:
-                p.data_nascimento = date.fromisoformat(provided_changes["data_nascimento"])
-            p.version = current_version + 1
-            sess.flush()
-            persist_event(sess, p, base_version=base_version, changes=provided_changes)
-            sess.commit()
-            sess.refresh(p)
-            return p
-
-        if client_version > current_version:
-            # cliente está à frente? inválido
-            raise HTTPException(status_code=409, detail="Versão do cliente adiantada em relação ao servidor")
-
-        # caminho de replay: cliente está atrasado (ex: v3 num servidor v5)
-        # 1) reconstruir snapshot em client_version
-        base_snapshot = snapshot_at_version(sess, pessoa_id, client_version)
-        # 2) aplicar mudanças do cliente
-        merged = apply_changes(base_snapshot, provided_changes)
-        # 3) re-aplicar eventos até a versão atual
-        final_state = replay_forward(sess, pessoa_id, client_version, current_version, merged)
-
-        # 4) persistir como nova versão (current_version + 1)
-        base_version = current_version
-        # aplicar no ORM com final_state
-        p.nome = final_state["nome"]
-        p.cpf = final_state["cpf"]
-        p.data_nascimento = date.fromisoformat(final_state["data_nascimento"])
-        p.version = current_version + 1
-        sess.flush()
-
-        # changes registrados devem ser o delta em relação ao estado antes da escrita (estado atual antes do patch)
-        prev_state = pessoa_to_dict(p)
-        # prev_state já reflete p.version incrementada; ajustamos para comparar com estado antes (current_version)
-        # Para manter simples, registramos as alterações que efetivamente foram aplicadas agora:
-        changes_now = {
-            "nome": p.nome,
-            "cpf": p.cpf,
-            "data_nascimento": p.data_nascimento.isoformat(),
-        }
-        persist_event(sess, p, base_version=base_version, changes=changes_now)
-        sess.commit()
-        sess.refresh(p)
-        return p
-    finally:
-        sess.close()
+        return row._asdict()
+
+    # caminho simples: UPDATE condicional à versão do cliente (OCC atômico, sem SELECT prévio)
+    # só escreve (nova versão + evento) se algum campo de fato mudar; o evento leva apenas
+    # os campos cujo valor difere do anterior (NULL no jsonb_build_object => removido)
+    antes = _PESSOA_ANTES
+    event_changes = func.jsonb_strip_nulls(func.jsonb_build_object(*(
+        arg
+        for k in provided_changes
+        for arg in (k, case((getattr(Pessoa, k).is_distinct_from(antes.c[k]), getattr(Pessoa, k))))
+    )))
+    row = (await execute_or_conflict(
+        sess,
+        with_event(
+            update(Pessoa)
+            .where(Pessoa.id == pessoa_id, Pessoa.version == client_version, Pessoa.deleted == False)  # noqa: E712
+            .where(antes.c.id == Pessoa.id)
+            .where(or_(*(getattr(Pessoa, k).is_distinct_from(v) for k, v in provided_changes.items())))
+            .values(**provided_changes, version=Pessoa.version + 1)
+            .returning(*_PESSOA_COLS, event_changes.label("changes")),
+        ),
+        "CPF já utilizado por outra pessoa",
+    )).one_or_none()
+    if row is not None:
+        await sess.commit()
+        await invalidate_cache(row.id)
+        return row._asdict()
+
+    # nenhuma linha atualizada: pessoa inexistente, versão divergente ou PATCH sem efeito
+    current = (await sess.execute(_GET_BY_ID, {"id": pessoa_id})).one_or_none()
+    if current is None:
+        raise HTTPException(status_code=404, detail="Pessoa não encontrada")
+    current_version = current.version
+    if client_version > current_version:
+        # cliente está à frente? inválido
+        raise HTTPException(status_code=409, detail="Versão do cliente adiantada em relação ao servidor")
+    if client_version == current_version:
+        # mesma versão e valores iguais aos atuais: nada a gravar (PATCH idempotente)
+        return current._asdict()
+
+    # caminho de replay: cliente está atrasado (ex: v3 num servidor v5)
+    # merge + nova versão (current_version + 1) calculados no banco, sem trazer snapshots/eventos
+    row = (await execute_or_conflict(sess, with_event(REPLAY_PATCH_SQL), "CPF já utilizado por outra pessoa", {
+        "id": pessoa_id,
+        "client_version": client_version,
+        "current_version": current_version,
+        "changes": provided_changes,
+    })).one_or_none()
+    if row is None:
+        current = (await sess.execute(_GET_BY_ID, {"id": pessoa_id})).one_or_none()
+        if current is not None and current.version == current_version:
+            # merge não alterou nada: retorna o estado atual sem nova versão
+            return current._asdict()
+        # outra escrita avançou a versão entre a leitura e o UPDATE
+        raise HTTPException(status_code=409, detail="Pessoa alterada concorrentemente, tente novamente")
+
+    await sess.commit()
+    await invalidate_cache(row.id)
+    return row._asdict()
 
 # 5) Remover (soft delete) com OCC
 @app.delete("/pessoas/{pessoa_id}", response_model=PessoaOut)
-def delete_pessoa(pessoa_id: int, version: int = Query(..., description="Versão conhecida pelo cliente")):
-    sess = SessionLocal()
-    try:
-        p = sess.query(Pessoa).filter(Pessoa.id == pessoa_id, Pessoa.deleted == False).one_or_none()  # noqa: E712
-        if not p:
+async def delete_pessoa(
+    pessoa_id: int = Path(..., ge=1, le=ID_MAX),
+    version: int = Query(..., ge=1, le=VERSION_MAX, description="Versão conhecida pelo cliente"),
+    sess: AsyncSession = Depends(get_session),
+):
+    # UPDATE condicional: só apaga se o cliente não estiver atrasado
+    row = (await sess.execute(with_event(
+        update(Pessoa)
+        .where(Pessoa.id == pessoa_id, Pessoa.version <= version, Pessoa.deleted == False)  # noqa: E712
+        .values(deleted=True, version=Pessoa.version + 1)
+        .returning(*_PESSOA_COLS),
+        {"deleted": True},
+    ))).one_or_none()
+    if row is None:
+        if (await sess.execute(_GET_VERSION, {"id": pessoa_id})).scalar_one_or_none() is None:
             raise HTTPException(status_code=404, detail="Pessoa não encontrada")
-        if version < p.version:
-            # podemos optar por replay para deletar mesmo com cliente atrasado
-            # aqui, rejeitamos para deixar claro
-            raise HTTPException(status_code=409, detail="Versão desatualizada para DELETE")
-
-        base_version = p.version
-        p.deleted = True
-        p.version = p.version + 1
-        sess.flush()
-        changes = {"deleted": True}
-        persist_event(sess, p, base_version=base_version, changes=changes)
-        sess.commit()
-        sess.refresh(p)
-        return p
-    finally:
-        sess.close()
+        # podemos optar por replay para deletar mesmo com cliente atrasado
+        # aqui, rejeitamos para deixar claro
+        raise HTTPException(status_code=409, detail="Versão desatualizada para DELETE")
+
+    await sess.commit()
+    await invalidate_cache(row.id)
+    return row._asdict()
+
+# 6) Criar pessoas em lote
+# um INSERT multi-linha com RETURNING para as pessoas e um executemany para os eventos;
+# o lote inteiro é uma transação, então o tamanho é limitado (acima de BULK_MAX => 422)
+BULK_MAX = 1000
+
+@app.post("/pessoas/bulk", response_model=List[PessoaOut], status_code=201)
+async def create_pessoas_bulk(
+    payload: List[PessoaCreate] = Body(..., max_length=BULK_MAX),
+    sess: AsyncSession = Depends(get_session),
+):
+    if not payload:
+        return []
+    rows = (await execute_or_conflict(
+        sess,
+        insert(Pessoa).returning(*_PESSOA_COLS, sort_by_parameter_order=True),
+        "CPF já cadastrado",
+        [
+            {"nome": item.nome, "cpf": item.cpf, "data_nascimento": item.data_nascimento, "version": 1, "deleted": False}
+            for item in payload
+        ],
+    )).all()
+    # evento de criação (base 0 -> new 1) para cada pessoa
+    await sess.execute(insert(PessoaEvent), [
+        {
+            "pessoa_id": row.id,
+            "base_version": 0,
+            "new_version": row.version,
+            "changes": {"nome": row.nome, "cpf": row.cpf, "data_nascimento": row.data_nascimento, "deleted": False},
+        }
+        for row in rows
+    ])
+    await sess.commit()
+    return [row._asdict() for row in rows]
 
 # Health
 @app.get("/health")
@@ -0,0 +1,7 @@
+-- 001: eventos guardam só o delta ('changes').
+-- Remove o snapshot completo por evento (pessoa_event.state_after) e a tabela de
+-- checkpoints, que não são mais lidos. DESTRUTIVA: faça backup antes.
+BEGIN;
+ALTER TABLE pessoa_event DROP COLUMN IF EXISTS state_after;
+DROP TABLE IF EXISTS pessoa_checkpoint;
+COMMIT;
@@ -0,0 +1,40 @@
+-- 002: recria pessoa_event particionada por hash de pessoa_id.
+-- Bancos criados antes do particionamento têm uma pessoa_event comum; o startup só cria
+-- partições numa tabela já particionada. Copia todos os eventos (trava pessoa_event
+-- durante a cópia: rode com a API parada). MODULUS deve bater com EVENT_PARTITIONS.
+BEGIN;
+LOCK TABLE pessoa_event IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE pessoa_event RENAME TO pessoa_event_old;
+ALTER INDEX pessoa_event_pkey RENAME TO pessoa_event_old_pkey;
+DROP INDEX IF EXISTS pessoa_event_pid_ver;
+
+CREATE TABLE pessoa_event (
+    id BIGINT NOT NULL DEFAULT nextval('pessoa_event_id_seq'),
+    pessoa_id BIGINT NOT NULL REFERENCES pessoa (id),
+    base_version INTEGER NOT NULL,
+    new_version INTEGER NOT NULL,
+    changes JSONB NOT NULL,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, pessoa_id)
+) PARTITION BY HASH (pessoa_id);
+
+DO $$
+BEGIN
+    FOR i IN 0..15 LOOP
+        EXECUTE format(
+            'CREATE TABLE pessoa_event_p%s PARTITION OF pessoa_event '
+            'FOR VALUES WITH (MODULUS 16, REMAINDER %s)', i, i
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO pessoa_event (id, pessoa_id, base_version, new_version, changes, created_at)
+SELECT id, pessoa_id, base_version, new_version, changes::jsonb, created_at FROM pessoa_event_old;
+
+-- a sequence do id passa para a tabela nova antes de a antiga ser removida
+ALTER SEQUENCE pessoa_event_id_seq OWNED BY pessoa_event.id;
+DROP TABLE pessoa_event_old;
+
+CREATE INDEX pessoa_event_pid_ver ON pessoa_event (pessoa_id, new_version DESC);
+COMMIT;